@@ -6,10 +6,15 @@ cool_btc_bot.py — BTC-бот с коллективным интервалом
 • Все, кто нажал «Subscribe», получают уведомления, когда цена BTC смещается
   минимум на N $, где N задаётся самими пользователями через кнопку
   «Interval ⚙️» (можно выбрать 50/100/200/500 или ввести своё число).
-• Подписчики и «последняя отправленная цена» хранятся в btc_bot_state.json.
+• Подписчики и «последняя отправленная цена» хранятся в SQLite (btc_bot.db,
+  WAL); старый btc_bot_state.json импортируется при первом запуске.
 • Глобальный интервал хранится в btc_collab.json (ключ "interval").
-• Русскоязычные логи выводятся в консоль и файл bot.log.
-• Требует python-telegram-bot ≥ 21 и requests.
+• Русскоязычные логи выводятся в консоль и файл bot.log (с ротацией).
+• Цена для алертов приходит из WebSocket-стрима Binance (btcusdt@miniTicker);
+  REST используется только для /price и подписки.
+• Горячий путь алертов вынесен в hot.py; его можно собрать mypyc
+  (python setup.py build_ext --inplace), иначе он работает как обычный модуль.
+• Требует python-telegram-bot ≥ 21, httpx[http2] и websockets.
 
 Изменения:
   1. Добавлен helper fmt_num() / fprice() для удобочитаемого форматирования
@@ -21,19 +26,31 @@ cool_btc_bot.py — BTC-бот с коллективным интервалом
 """
 
 import asyncio
+import functools
+import heapq
 import json
 import logging
 import os
+import socket
+import sqlite3
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from logging.handlers import RotatingFileHandler
 from pathlib import Path
 from typing import Any, Dict, List
 
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+import httpx
+import websockets
+
+try:
+    import orjson
+except ImportError:  # orjson опционален, fallback на stdlib json
+    orjson = None
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
-from telegram.error import TelegramError
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+from telegram.request import HTTPXRequest
 from telegram.ext import (
     Application,
     CallbackQueryHandler,
@@ -43,13 +60,36 @@ from telegram.ext import (
     filters,
 )
 
+import hot
+from hot import alert_text, fprice, pop_crossed
+
 # ──────────────── Файлы и константы ────────────────
-STATE_FILE  = Path("btc_bot_state.json")      # {uid: last_price}
+DB_FILE     = Path("btc_bot.db")               # subs(uid, last)
+STATE_FILE  = Path("btc_bot_state.json")      # legacy {uid: last_price}
 COLLAB_FILE = Path("btc_collab.json")         # {"interval": N}
 LOG_FILE    = Path("bot.log")
-POLL_SEC    = 5                                # опрос Binance, сек
+LOG_MAX     = 5_000_000                        # размер bot.log до ротации, байт
+LOG_BACKUPS = 3                                # сколько bot.log.N хранить
+WS_URL      = "wss://stream.binance.com:9443/ws/btcusdt@miniTicker"
+WS_BACKOFF  = (1, 60)                          # пауза переподключения, сек (мин, макс)
 DEFAULT_INT = 200                              # шаг по умолчанию
 CHOICES     = [50, 100, 200, 500]              # быстрый выбор
+FLUSH_SEC   = 30                               # сброс состояния на диск, сек
+SEND_RATE   = 30                               # лимит Telegram, сообщений/сек
+SEND_CONC   = 29                               # одновременных send_message
+SEND_WORKERS = 8                               # воркеров рассылки алертов
+OUT_QUEUE   = 10_000                           # суммарный лимит очередей алертов
+TG_POOL     = 20                               # соединений к api.telegram.org
+
+_INTERVAL_KBD = InlineKeyboardMarkup([
+    [InlineKeyboardButton(str(n), callback_data=f"step_{n}") for n in CHOICES],
+    [InlineKeyboardButton("Ввести…", callback_data="step_custom")],
+])
+
+HOT_API = 2   # ожидаемая версия интерфейса hot.py
+if getattr(hot, "HOT_API", None) != HOT_API:
+    sys.exit(f"⚠️  {hot.__file__} устарел (HOT_API {getattr(hot, 'HOT_API', None)} ≠ {HOT_API}): "
+             "пересоберите (python setup.py build_ext --inplace) или удалите hot.*.so")
 
 # ──────────────── Токен бота ────────────────
 try:
@@ -65,7 +105,7 @@ if TOKEN.startswith("PUT_"):
 FMT = "%(_asctime)s | %(levelname)-8s | %(message)s".replace("_", "")
 root = logging.getLogger(); root.setLevel(logging.INFO)
 sh = logging.StreamHandler(sys.stdout); sh.setFormatter(logging.Formatter(FMT)); root.addHandler(sh)
-fh = logging.FileHandler(LOG_FILE, encoding="utf-8"); fh.setFormatter(logging.Formatter(FMT)); root.addHandler(fh)
+fh = RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX, backupCount=LOG_BACKUPS, encoding="utf-8"); fh.setFormatter(logging.Formatter(FMT)); root.addHandler(fh)
 for name in ("telegram", "httpx", "apscheduler"):
     logging.getLogger(name).setLevel(logging.WARNING)
 log = logging.getLogger("bot")
@@ -73,78 +113,337 @@ log = logging.getLogger("bot")
 # ──────────────── Глобальное состояние ────────────────
 _subs: Dict[int, float] = {}   # uid → last_notified_price
 _interval: int = DEFAULT_INT
+_subs_pending: Dict[int, float] = {}   # uid → last, ещё не записанные в БД
+_collab_dirty = False          # _interval изменён, но не записан
+_last_flush = 0.0              # time.monotonic() последнего сброса
+
+# Кучи для выборки только тех подписчиков, чей шаг пройден. Записи ленивые:
+# запись (last, uid) актуальна, пока _subs.get(uid) == last.
+_hi: List[tuple[float, int]] = []   # (last, uid)  — кандидаты на рост цены
+_lo: List[tuple[float, int]] = []   # (-last, uid) — кандидаты на падение цены
+_inflight: set[int] = set()          # uid, чей алерт стоит в очереди / отправляется
+
+def rebuild_heaps():
+    """Перестраивает _hi/_lo по _subs, отбрасывая устаревшие записи."""
+    _hi[:] = [(last, uid) for uid, last in _subs.items()]
+    _lo[:] = [(-last, uid) for uid, last in _subs.items()]
+    heapq.heapify(_hi); heapq.heapify(_lo)
+
+def _maybe_rebuild():
+    if max(len(_hi), len(_lo)) > 2 * len(_subs) + 64:   # слишком много мёртвых записей
+        rebuild_heaps()
+
+def track_sub(uid: int, last: float):
+    """Регистрирует актуальную цену подписчика в кучах."""
+    heapq.heappush(_hi, (last, uid)); heapq.heappush(_lo, (-last, uid))
+    _maybe_rebuild()
+
+def retrack_sub(uid: int, last: float, up: bool):
+    """Возвращает запись в ту кучу, из которой её сняли (up — рост цены → _hi)."""
+    if up:
+        heapq.heappush(_hi, (last, uid))
+    else:
+        heapq.heappush(_lo, (-last, uid))
+    _maybe_rebuild()
 
-# ──────────────── Форматирование чисел ────────────────
+def drop_sub(uid: int) -> bool:
+    """Удаляет подписчика из памяти и БД; True — если он был подписан."""
+    if _subs.pop(uid, None) is None:
+        return False
+    _subs_pending.pop(uid, None); db_submit(db_delete, uid)
+    return True
 
-def fmt_num(n: float) -> str:
-    """Возвращает число с пробелом-разделителем тысяч и 2 знаками после запятой."""
-    return f"{n:,.2f}".replace(",", " ")
+# ──────────────── Helpers JSON ────────────────
 
-def fprice(n: float) -> str:
-    """Удобочитаемая цена с $ на конце."""
-    return f"{fmt_num(n)}$"
+if orjson is not None:
+    def jloads(raw: bytes | str) -> Any:
+        return orjson.loads(raw)
 
-# ──────────────── Helpers JSON ────────────────
+    def jdumps(data: Any) -> bytes:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+else:
+    def jloads(raw: bytes | str) -> Any:
+        return json.loads(raw)
+
+    def jdumps(data: Any) -> bytes:
+        return json.dumps(data, ensure_ascii=False, indent=2).encode()
 
 def read_json(path: Path, default: Any):
     try:
-        return json.loads(path.read_text()) if path.exists() else default
+        return jloads(path.read_bytes()) if path.exists() else default
     except Exception as e:
         log.error("Не смог прочитать %s: %s", path, e); return default
 
-def write_json(path: Path, data: Any):
+_last_written: Dict[Path, bytes] = {}   # path → последние записанные байты
+
+def write_atomic(path: Path, blob: bytes):
+    """Атомарная запись: tmp + fsync + os.replace + fsync каталога.
+
+    Если байты не изменились с прошлой записи — ничего не делает.
+    """
     try:
+        if _last_written.get(path) == blob:
+            return
         tmp = path.with_suffix(".tmp")
-        tmp.write_text(json.dumps(data, ensure_ascii=False, indent=2))
-        tmp.replace(path)
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.write(fd, blob)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.replace(tmp, path)
+        if hasattr(os, "O_DIRECTORY"):   # на Windows каталог не fsync-ается
+            dfd = os.open(path.parent, os.O_DIRECTORY)
+            try:
+                os.fsync(dfd)
+            finally:
+                os.close(dfd)
+        _last_written[path] = blob
     except Exception as e:
         log.error("Не смог записать %s: %s", path, e)
 
-# ──────────────── HTTP session with retry ────────────────
-_session: requests.Session | None = None
-
-def get_http_session() -> requests.Session:
-    """Создаёт/возвращает requests.Session с keep-alive и автоматическим Retry."""
-    global _session
-    if _session is None:
-        _session = requests.Session()
-        retry = Retry(
-            total=3,
-            backoff_factor=0.5,
-            status_forcelist=(429, 500, 502, 503, 504),
-            allowed_methods=("GET",),
-        )
-        _session.mount("https://", HTTPAdapter(max_retries=retry))
-        _session.headers.update({"User-Agent": "CoolBTCBot/1.0"})
-    return _session
+def write_json(path: Path, data: Any):
+    write_atomic(path, jdumps(data))
+
+# Фоновая запись файлов: продюсеры только кладут снимок в очередь и не ждут диск.
+_write_q: asyncio.Queue[tuple[Path, bytes]] = asyncio.Queue()
+_writer_task: asyncio.Task | None = None
+
+def save_json(path: Path, data: Any):
+    """Ставит снимок data в очередь фоновой записи (без ожидания)."""
+    _write_q.put_nowait((path, jdumps(data)))
+
+async def writer():
+    """Фоновая задача: пишет снимки из _write_q, оставляя только последний на файл."""
+    while True:
+        path, blob = await _write_q.get()
+        latest = {path: blob}; n = 1
+        while not _write_q.empty():
+            path, blob = _write_q.get_nowait()
+            latest[path] = blob; n += 1
+        try:
+            for path, blob in latest.items():
+                await asyncio.to_thread(write_atomic, path, blob)
+        finally:
+            for _ in range(n):
+                _write_q.task_done()
+
+# ──────────────── SQLite-хранилище подписчиков ────────────────
+_db: sqlite3.Connection | None = None
+# Один поток на все запросы к БД: запись и удаление выполняются строго по порядку.
+_db_exec = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+
+def db_open(path: Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS subs(uid INTEGER PRIMARY KEY, last REAL NOT NULL)")
+    return conn
+
+def db_load() -> Dict[int, float]:
+    return {uid: last for uid, last in _db.execute("SELECT uid, last FROM subs")}
+
+def db_upsert(rows: List[tuple[int, float]]):
+    """Записывает пачку (uid, last) одной транзакцией — один fsync на пачку."""
+    try:
+        _db.execute("BEGIN")
+        _db.executemany(
+            "INSERT INTO subs(uid, last) VALUES(?, ?) "
+            "ON CONFLICT(uid) DO UPDATE SET last=excluded.last", rows)
+        _db.execute("COMMIT")
+    except sqlite3.Error as e:
+        if _db.in_transaction:
+            _db.execute("ROLLBACK")
+        log.error("Не смог записать подписчиков в %s: %s", DB_FILE, e)
+
+def db_delete(uid: int):
+    try:
+        _db.execute("DELETE FROM subs WHERE uid = ?", (uid,))
+    except sqlite3.Error as e:
+        log.error("Не смог удалить UID %d из %s: %s", uid, DB_FILE, e)
+
+def _db_done(fut):
+    if not fut.cancelled() and fut.exception() is not None:
+        e = fut.exception()
+        log.error("Ошибка операции с БД: %s", e, exc_info=(type(e), e, e.__traceback__))
+
+def db_submit(fn, *args):
+    """Ставит fn(*args) в очередь потока БД (без ожидания)."""
+    _db_exec.submit(fn, *args).add_done_callback(_db_done)
+
+def migrate_legacy_state():
+    """Переносит подписчиков из btc_bot_state.json в БД (однократно)."""
+    if not STATE_FILE.exists():
+        return
+    if _db.execute("SELECT 1 FROM subs LIMIT 1").fetchone() is None:
+        legacy = read_json(STATE_FILE, {})
+        db_upsert([(int(k), float(v)) for k, v in legacy.items()])
+        log.info("Импортировано подписчиков из %s: %d", STATE_FILE, len(legacy))
+    STATE_FILE.replace(STATE_FILE.with_suffix(".json.bak"))
+
+def flush_state(force: bool = False):
+    """Отдаёт изменённое состояние на запись не чаще раза в FLUSH_SEC (или сразу при force)."""
+    global _collab_dirty, _last_flush
+    if not (_subs_pending or _collab_dirty):
+        return
+    if not force and time.monotonic() - _last_flush < FLUSH_SEC:
+        return
+    if _subs_pending:
+        rows = list(_subs_pending.items()); _subs_pending.clear()
+        db_submit(db_upsert, rows)
+    if _collab_dirty:
+        _collab_dirty = False
+        save_json(COLLAB_FILE, {"interval": _interval})
+    _last_flush = time.monotonic()
+
+# ──────────────── HTTP-клиент ────────────────
+_http: httpx.AsyncClient | None = None
+
+def make_http_client() -> httpx.AsyncClient:
+    """Создаёт httpx.AsyncClient с пулом keep-alive соединений к Binance."""
+    transport = httpx.AsyncHTTPTransport(
+        limits=httpx.Limits(max_keepalive_connections=4, keepalive_expiry=30.0),
+        http2=True,
+        retries=3,                                 # повтор при ошибках соединения; статусы — в get_price()
+        socket_options=[(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)],
+    )
+    return httpx.AsyncClient(
+        transport=transport,
+        timeout=5.0,
+        headers={"User-Agent": "CoolBTCBot/1.0"},
+    )
 
 # ──────────────── Binance API ────────────────
 FAIL_LIMIT = 5; _fail_seq = 0
+RETRY_STATUS = (429, 500, 502, 503, 504)      # статусы, при которых повторяем запрос
+RETRY_TOTAL = 3; RETRY_BACKOFF = 0.5           # попыток и базовая пауза, сек
+RETRY_AFTER_MAX = 10.0                          # дольше Retry-After не ждём — сдаёмся
+
+def _retry_after(r: httpx.Response) -> float:
+    """Retry-After (в секундах) для 429/503; 0 — если заголовка нет или он не число."""
+    if r.status_code not in (429, 503):
+        return 0.0
+    try:
+        return max(float(r.headers.get("Retry-After", 0)), 0.0)
+    except ValueError:
+        return 0.0
+_BINANCE_URL = "https://api.binance.com/api/v3/ticker/price"
+_BINANCE_PARAMS = httpx.QueryParams({"symbol": "BTCUSDT"})
+_BINANCE_PING = "https://api.binance.com/api/v3/ping"
+
+async def warm_up_http():
+    """Заранее открывает TLS-соединение к Binance, чтобы первый /price не ждал хендшейк."""
+    try:
+        r = await _http.get(_BINANCE_PING, timeout=3.0)
+        r.raise_for_status()
+    except httpx.HTTPError as e:
+        log.warning("Не смог прогреть соединение с Binance: %s", e)
 
-def get_price() -> float | None:
+async def get_price() -> float | None:
     global _fail_seq
-    session = get_http_session()
+    if _http is None:
+        log.error("HTTP-клиент не инициализирован"); return None
     try:
-        r = session.get(
-            "https://api.binance.com/api/v3/ticker/price",
-            params={"symbol": "BTCUSDT"},
-            timeout=5,
-        )
+        for attempt in range(RETRY_TOTAL + 1):
+            r = await _http.get(_BINANCE_URL, params=_BINANCE_PARAMS)
+            if r.status_code not in RETRY_STATUS or attempt == RETRY_TOTAL:
+                break
+            wait = _retry_after(r)
+            if wait > RETRY_AFTER_MAX:   # Binance банит IP (418) за запросы раньше срока
+                break
+            await asyncio.sleep(max(wait, RETRY_BACKOFF * 2 ** attempt))
         r.raise_for_status()
-        p = float(r.json()["price"])
+        p = float(jloads(r.content)["price"])
         _fail_seq = 0
-        log.info("Цена BTC: %.2f$", p)
+        log.debug("Цена BTC: %.2f$", p)
         return p
     except (ValueError, KeyError) as e:
         _fail_seq += 1
         log.error("Неверный JSON Binance (%d): %s", _fail_seq, e)
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
         _fail_seq += 1
         log.warning("HTTP-ошибка Binance (%d): %s", _fail_seq, e)
     if _fail_seq >= FAIL_LIMIT:
         log.error("Достигнут предел %d ошибок Binance API", FAIL_LIMIT)
     return None
 
+_price_cache: tuple[float, float] | None = None   # (цена, time.monotonic())
+_price_lock = asyncio.Lock()
+
+async def get_price_cached(ttl: float = 1.0) -> float | None:
+    """get_price() с кэшем на ttl секунд: пачка /price → один запрос к Binance."""
+    global _price_cache
+    if _price_cache and time.monotonic() - _price_cache[1] < ttl:
+        return _price_cache[0]
+    async with _price_lock:
+        if _price_cache and time.monotonic() - _price_cache[1] < ttl:
+            return _price_cache[0]
+        p = await get_price()
+        if p is not None:
+            _price_cache = (p, time.monotonic())
+        return p
+
+# ──────────────── Рассылка с ограничением скорости ────────────────
+
+class TokenBucket:
+    """Асинхронный token bucket: не более rate токенов в секунду."""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self._tokens = rate
+        self._ts = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.rate, self._tokens + (now - self._ts) * self.rate)
+                self._ts = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+_send_sem = asyncio.Semaphore(SEND_CONC)
+_bucket = TokenBucket(SEND_RATE)
+
+async def _send(bot, uid: int, txt: str) -> bool:
+    """Отправляет сообщение с учётом лимитов; True — если доставлено.
+
+    RetryAfter пробрасывается наружу: решение о паузе принимает вызывающий.
+    """
+    async with _send_sem:
+        await _bucket.acquire()
+        try:
+            await bot.send_message(uid, txt)
+            return True
+        except RetryAfter:
+            raise
+        except Forbidden as te:   # бот заблокирован — повторять бессмысленно
+            if drop_sub(uid):
+                log.info("UID %d заблокировал бота, подписка снята: %s", uid, te)
+            return False
+        except BadRequest as te:
+            if "chat not found" in str(te).lower():   # чата больше нет
+                if drop_sub(uid):
+                    log.info("Чат UID %d не найден, подписка снята", uid)
+            else:
+                log.error("Ошибка отправки %d: %s", uid, te)
+            return False
+        except TelegramError as te:
+            log.error("Ошибка отправки %d: %s", uid, te)
+            return False
+
+async def broadcast(bot, msgs: List[tuple[int, str]]) -> List[bool]:
+    """Параллельно рассылает [(uid, txt), …]; возвращает флаги доставки."""
+    res = await asyncio.gather(*(_send(bot, uid, txt) for uid, txt in msgs),
+                               return_exceptions=True)
+    for (uid, _), r in zip(msgs, res):
+        if isinstance(r, BaseException):
+            log.error("Ошибка отправки %d: %s", uid, r)
+    return [r is True for r in res]
+
 # ──────────────── Telegram UI ────────────────
 WELCOME = (
     "👋 <b>BTC-бот</b>\n\n"
@@ -153,7 +452,23 @@ WELCOME = (
     "Текущий интервал: <b>{}</b> $."
 )
 
+_welcome_cache: str | None = None   # WELCOME для текущего _interval
+
+def welcome_text() -> str:
+    """WELCOME с текущим интервалом; сбрасывается в change_interval()."""
+    global _welcome_cache
+    if _welcome_cache is None:
+        _welcome_cache = WELCOME.format(_interval)
+    return _welcome_cache
+
+@functools.lru_cache(maxsize=16)
+def interval_msg(v: int) -> str:
+    return f"Текущий интервал: {v}$"
+
 def main_kbd(subscribed: bool) -> InlineKeyboardMarkup:
+    return _MAIN_KBD[subscribed]
+
+def _build_main_kbd(subscribed: bool) -> InlineKeyboardMarkup:
     rows: List[List[InlineKeyboardButton]] = []
     if subscribed:
         rows.append([
@@ -166,13 +481,15 @@ def main_kbd(subscribed: bool) -> InlineKeyboardMarkup:
     rows.append([InlineKeyboardButton("Price", callback_data="price")])
     return InlineKeyboardMarkup(rows)
 
+_MAIN_KBD = {s: _build_main_kbd(s) for s in (False, True)}
+
 # ──────────────── Команды ────────────────
 async def cmd_start(u: Update, ctx: ContextTypes.DEFAULT_TYPE):
     uid = u.effective_chat.id
-    await u.message.reply_html(WELCOME.format(_interval), reply_markup=main_kbd(uid in _subs))
+    await u.message.reply_html(welcome_text(), reply_markup=main_kbd(uid in _subs))
 
 async def cmd_price(u: Update, ctx: ContextTypes.DEFAULT_TYPE):
-    p = get_price()
+    p = await get_price_cached()
     await u.message.reply_text(f"BTC = {fprice(p)}" if p else "⛔ Цена недоступна.")
 
 # ──────────────── Inline кнопки ────────────────
@@ -183,31 +500,30 @@ async def cb_btn(u: Update, ctx: ContextTypes.DEFAULT_TYPE):
 
     # ——— Быстрый просмотр цены ———
     if data == "price":
-        p = get_price()
+        p = await get_price_cached()
         return await q.message.reply_text(
             f"BTC = {fprice(p)}" if p else "⛔ Цена недоступна."
         )
 
     # ——— Подписка / Отписка ———
     if data == "sub":
-        p = get_price()
+        p = await get_price()
         if p is None:
             return await q.message.reply_text("⛔ Цена недоступна. Попробуйте позже.")
-        _subs[uid] = p; write_json(STATE_FILE, _subs)
+        _subs[uid] = p; track_sub(uid, p)
+        _subs_pending.pop(uid, None); db_submit(db_upsert, [(uid, p)])
         log.info("UID %d подписался (%.2f$)", uid, p)
         return await q.message.edit_text("✅ Подписка оформлена.", reply_markup=main_kbd(True))
 
     if data == "unsub":
-        if _subs.pop(uid, None):
-            write_json(STATE_FILE, _subs); log.info("UID %d отписался", uid)
+        if drop_sub(uid):
+            log.info("UID %d отписался", uid)
         return await q.message.edit_text("❎ Подписка отменена.", reply_markup=main_kbd(False))
 
     # ——— Настройка интервала ———
     if data == "interval":
-        rows = [[InlineKeyboardButton(str(n), callback_data=f"step_{n}") for n in CHOICES],
-                [InlineKeyboardButton("Ввести…", callback_data="step_custom")]]
         return await q.message.reply_text(
-            f"Текущий интервал: {_interval}$", reply_markup=InlineKeyboardMarkup(rows))
+            interval_msg(_interval), reply_markup=_INTERVAL_KBD)
 
     if data.startswith("step_"):
         if data == "step_custom":
@@ -236,53 +552,137 @@ async def change_interval(val: int, by_uid: int, bot, notify_changer: bool = Fal
 
     notify_changer=False — не слать broadcast инициатору, он получит edit_text/reply.
     """
-    global _interval
-    old = _interval; _interval = val; write_json(COLLAB_FILE, {"interval": _interval})
+    global _interval, _collab_dirty, _welcome_cache
+    old = _interval; _interval = val; _collab_dirty = True
+    _welcome_cache = None
     log.info("Интервал %d → %d (uid=%d)", old, val, by_uid)
     txt = f"⚙️ Интервал изменён: {old} → {val} $"
-    for uid in list(_subs):
-        if uid == by_uid and not notify_changer:
-            continue
-        try:
-            await bot.send_message(uid, txt)
-        except TelegramError:
-            log.warning("Не смог оповестить %d", uid)
+    await broadcast(bot, [(uid, txt) for uid in list(_subs)
+                          if uid != by_uid or notify_changer])
     return txt
 
 # ──────────────── Watcher ────────────────
+# Очереди алертов (uid, txt, p, last), шардированные по uid: порядок для
+# каждого uid сохраняется, а медленный Telegram не тормозит приём цены.
+_out: List[asyncio.Queue] = [asyncio.Queue(maxsize=OUT_QUEUE // SEND_WORKERS)
+                             for _ in range(SEND_WORKERS)]
+
+async def check_alerts(p: float):
+    """Ставит в очередь алерты подписчикам, чья цена сместилась на шаг и более."""
+    step = _interval
+    hits = pop_crossed(_hi, _lo, _subs, _inflight, p, step)
+    if not hits:
+        return
+    log.info("Алертов в очереди: %d (цена %.2f$, шаг %d$)", len(hits), p, step)
+    for uid, last in hits.items():
+        _inflight.add(uid)
+        await _out[uid % SEND_WORKERS].put((uid, alert_text(p, last, step), p, last))
+
+async def sender(bot, q: asyncio.Queue):
+    """Воркер рассылки: отправляет алерты из очереди и обновляет цену подписчика."""
+    while True:
+        uid, txt, p, last = await q.get()
+        release = True   # снять uid из _inflight сразу после обработки
+        try:
+            if _subs.get(uid) != last:   # отписался/переподписался, пока алерт ждал
+                continue
+            ok = await _send(bot, uid, txt)
+            if _subs.get(uid) != last:   # … или пока шла отправка
+                continue
+            if ok:
+                log.debug("Алерт UID %d: %.2f$ → %.2f$", uid, last, p)
+                _subs[uid] = _subs_pending[uid] = p
+                track_sub(uid, p)
+            else:
+                retrack_sub(uid, last, p > last)   # повторим на следующем тике
+        except RetryAfter as e:
+            # Держим uid в _inflight, пока Telegram не разрешит слать снова.
+            ra = e.retry_after
+            wait = ra.total_seconds() if hasattr(ra, "total_seconds") else float(ra)
+            log.warning("Flood control для UID %d: пауза %.0f с", uid, wait)
+            if _subs.get(uid) == last:
+                retrack_sub(uid, last, p > last)
+            asyncio.get_running_loop().call_later(wait, _inflight.discard, uid)
+            release = False
+        except Exception as e:
+            log.exception("Необработанная ошибка в sender: %s", e)
+            if _subs.get(uid) == last:
+                retrack_sub(uid, last, p > last)
+        finally:
+            if release:
+                _inflight.discard(uid)
+            q.task_done()
+
 async def watcher(app: Application):
-    """Фоновый цикл: опрашивает цену и рассылает алерты."""
-    log.info("Watcher запущен (%d с)", POLL_SEC)
+    """Фоновый цикл: слушает стрим цены Binance и рассылает алерты."""
+    log.info("Watcher запущен (%s)", WS_URL)
+    delay = WS_BACKOFF[0]
     while True:
         try:
-            p = get_price()
-            if p is not None:
-                step = _interval
-                for uid, last in list(_subs.items()):
-                    if abs(p - last) >= step:
-                        diff = p - last
-                        sym = "🚀↑" if diff > 0 else "🔻↓"
-                        diff_fmt = f"{diff:+,.2f}".replace(",", " ")
-                        txt = f"{sym} BTC {fprice(p)}  (Δ {diff_fmt}$, шаг {step}$)"
-                        try:
-                            await app.bot.send_message(uid, txt)
-                            _subs[uid] = p
-                        except TelegramError as te:
-                            log.error("Ошибка отправки %d: %s", uid, te)
-                write_json(STATE_FILE, _subs)
+            async with websockets.connect(WS_URL) as ws:
+                log.info("WebSocket Binance подключён")
+                delay = WS_BACKOFF[0]
+                async for raw in ws:
+                    try:
+                        p = float(jloads(raw)["c"])
+                    except (ValueError, KeyError, TypeError) as e:
+                        log.error("Неверное сообщение стрима Binance: %s", e)
+                        continue
+                    await check_alerts(p)
+                    flush_state()
+        except (websockets.WebSocketException, OSError) as e:
+            log.warning("WebSocket Binance разорван: %s", e)
         except Exception as e:
             log.exception("Необработанная ошибка в watcher: %s", e)
-        await asyncio.sleep(POLL_SEC)
+        flush_state()
+        log.info("Переподключение через %d с", delay)
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, WS_BACKOFF[1])
 
 # ──────────────── Инициализация ────────────────
+# post_init выполняется до app.running, поэтому app.create_task() эти задачи
+# не отслеживает — держим их сами и останавливаем в _post_shutdown.
+_bg_tasks: List[asyncio.Task] = []   # watcher + sender'ы
+
 async def _post_init(app: Application):
-    app.create_task(watcher(app))
+    global _http, _writer_task
+    _http = make_http_client()
+    _writer_task = asyncio.create_task(writer())
+    await warm_up_http()
+    _bg_tasks.extend(asyncio.create_task(sender(app.bot, q)) for q in _out)
+    _bg_tasks.append(asyncio.create_task(watcher(app)))
+
+async def _post_shutdown(app: Application):
+    # Пулы Telegram (HTTPXRequest) PTB закрывает сам; клиент Binance и writer — наши.
+    global _http, _writer_task
+    for t in _bg_tasks:
+        t.cancel()
+    await asyncio.gather(*_bg_tasks, return_exceptions=True)
+    _bg_tasks.clear()
+    flush_state(force=True)
+    if _http is not None:
+        await _http.aclose(); _http = None
+    if _writer_task is not None:
+        await _write_q.join()
+        _writer_task.cancel(); _writer_task = None
 
 def build_app() -> Application:
+    # send_message из sender/broadcast идут через общий HTTP/2-пул;
+    # long polling getUpdates держит своё отдельное соединение.
+    request = HTTPXRequest(
+        connection_pool_size=TG_POOL,
+        pool_timeout=5.0,
+        read_timeout=10.0,
+        connect_timeout=5.0,
+        http_version="2",
+    )
     app = (
         Application.builder()
         .token(TOKEN)
+        .request(request)
+        .get_updates_request(HTTPXRequest(http_version="2"))
         .post_init(_post_init)
+        .post_shutdown(_post_shutdown)
         .build()
     )
     app.add_handler(CommandHandler("start", cmd_start))
@@ -294,8 +694,11 @@ def build_app() -> Application:
 # ──────────────── Main ────────────────
 
 def main():
-    global _subs, _interval
-    _subs = read_json(STATE_FILE, {})
+    global _subs, _interval, _db
+    _db = db_open(DB_FILE)
+    migrate_legacy_state()
+    _subs = db_load()
+    rebuild_heaps()
     _interval = read_json(COLLAB_FILE, {"interval": DEFAULT_INT}).get("interval", DEFAULT_INT)
 
     app = build_app()
@@ -305,8 +708,12 @@ def main():
     except KeyboardInterrupt:
         log.info("KeyboardInterrupt — остановка…")
     finally:
-        if '_session' in globals() and _session is not None:
-            _session.close()
+        _db_exec.shutdown(wait=True)
+        if _subs_pending:
+            db_upsert(list(_subs_pending.items()))
+        if _collab_dirty:
+            write_json(COLLAB_FILE, {"interval": _interval})
+        _db.close()
         log.info("Выключено в %s", datetime.now().strftime("%d.%m.%Y %H:%M:%S"))
 
 if __name__ == "__main__":
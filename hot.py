@@ -0,0 +1,67 @@
+"""
+hot.py — горячий путь алертов: форматирование чисел и выбор подписчиков
+───────────────────────────────────────────────────────────────────────
+Модуль можно скомпилировать mypyc (python setup.py build_ext --inplace);
+без собранного расширения импортируется этот же файл как чистый Python.
+
+Внимание: собранный hot.*.so имеет приоритет над hot.py. После любой
+правки этого файла расширение нужно пересобрать или удалить, а при
+изменении сигнатур — увеличить HOT_API (cool_btc_bot.py сверяет его).
+"""
+
+import heapq
+from typing import Dict, List, Set, Tuple
+
+HOT_API = 2   # версия интерфейса модуля; см. HOT_API в cool_btc_bot.py
+
+_SP = str.maketrans({",": " "})   # разделитель тысяч: запятая → пробел
+
+def fmt_num(n: float) -> str:
+    """Возвращает число с пробелом-разделителем тысяч и 2 знаками после запятой."""
+    return format(n, ",.2f").translate(_SP)
+
+def fprice(n: float) -> str:
+    """Удобочитаемая цена с $ на конце."""
+    return f"{fmt_num(n)}$"
+
+def alert_text(p: float, last: float, step: int) -> str:
+    """Текст алерта о смещении цены с last до p."""
+    diff = p - last
+    sym = "🚀↑" if diff > 0 else "🔻↓"
+    diff_fmt = format(diff, "+,.2f").translate(_SP)
+    return f"{sym} BTC {fprice(p)}  (Δ {diff_fmt}$, шаг {step}$)"
+
+def pop_crossed(hi: List[Tuple[float, int]], lo: List[Tuple[float, int]],
+                subs: Dict[int, float], busy: Set[int],
+                p: float, step: float) -> Dict[int, float]:
+    """Снимает с куч подписчиков, для которых |p - last| ≥ step.
+
+    hi — min-куча (last, uid), lo — min-куча (-last, uid); записи, не
+    совпадающие с subs, считаются устаревшими и отбрасываются. Актуальные
+    записи uid из busy (алерт ещё в очереди) остаются в кучах.
+    Возвращает {uid: last}.
+    """
+    hits: Dict[int, float] = {}
+    held_hi: List[Tuple[float, int]] = []
+    held_lo: List[Tuple[float, int]] = []
+    while hi and p - hi[0][0] >= step:
+        item = heapq.heappop(hi)
+        last, uid = item
+        if subs.get(uid) == last:
+            if uid in busy:
+                held_hi.append(item)
+            else:
+                hits[uid] = last
+    while lo and -lo[0][0] - p >= step:
+        item = heapq.heappop(lo)
+        neg, uid = item
+        if subs.get(uid) == -neg:
+            if uid in busy:
+                held_lo.append(item)
+            else:
+                hits[uid] = -neg
+    for item in held_hi:
+        heapq.heappush(hi, item)
+    for item in held_lo:
+        heapq.heappush(lo, item)
+    return hits
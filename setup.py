@@ -0,0 +1,14 @@
+"""Сборка hot.py в C-расширение: python setup.py build_ext --inplace (нужен mypy).
+
+Собранный hot.*.so загружается вместо hot.py — после изменений в hot.py
+пересоберите его или удалите.
+"""
+
+from setuptools import setup
+from mypyc.build import mypycify
+
+setup(
+    name="cool-btc-bot-hot",
+    py_modules=[],
+    ext_modules=mypycify(["hot.py"]),
+)